@@ -65,9 +65,11 @@ back to rank 4.
 
 import functools
 import inspect
+import operator
 import sys
 import tensorflow as tf
 
+from tensorflow.python.framework import tensor_util
 from tensorflow.python.ops import control_flow_ops
 
 from core import box_list
@@ -261,7 +263,8 @@ def normalize_image(image, original_minval, original_maxval, target_minval,
     original_maxval = float(original_maxval)
     target_minval = float(target_minval)
     target_maxval = float(target_maxval)
-    image = tf.to_float(image)
+    if image.dtype != tf.float32:
+      image = tf.to_float(image)
     image = tf.subtract(image, original_minval)
     image = tf.multiply(image, (target_maxval - target_minval) /
                         (original_maxval - original_minval))
@@ -1028,36 +1031,55 @@ def random_distort_color(image, color_ordering=0, preprocess_vars_cache=None):
     ValueError: if color_ordering is not in {0, 1}.
   """
   with tf.name_scope('RandomDistortColor', values=[image]):
-    if color_ordering == 0:
-      image = random_adjust_brightness(
-          image, max_delta=32. / 255.,
-          preprocess_vars_cache=preprocess_vars_cache)
-      image = random_adjust_saturation(
-          image, min_delta=0.5, max_delta=1.5,
-          preprocess_vars_cache=preprocess_vars_cache)
-      image = random_adjust_hue(
-          image, max_delta=0.2,
-          preprocess_vars_cache=preprocess_vars_cache)
-      image = random_adjust_contrast(
-          image, min_delta=0.5, max_delta=1.5,
-          preprocess_vars_cache=preprocess_vars_cache)
+    # The adjustments below work on pixels in [0, 1]: rescaling once at each
+    # end of the chain and clipping in the [0, 1] domain is equivalent to the
+    # per-step rescale and [0, 255] clip done by the standalone
+    # random_adjust_* functions, but saves two passes over the image per
+    # adjustment. The same cache keys are used, so cached replays match.
+    def _get_rand_var(generator_func, function_id):
+      return _get_or_create_preprocess_rand_vars(
+          generator_func, function_id, preprocess_vars_cache)
+
+    def _adjust_brightness(image):
+      delta = _get_rand_var(
+          functools.partial(tf.random_uniform, [], -32. / 255., 32. / 255.),
+          preprocessor_cache.PreprocessorCache.ADJUST_BRIGHTNESS)
+      return tf.clip_by_value(tf.image.adjust_brightness(image, delta),
+                              0.0, 1.0)
+
+    def _adjust_saturation(image):
+      saturation_factor = _get_rand_var(
+          functools.partial(tf.random_uniform, [], 0.5, 1.5),
+          preprocessor_cache.PreprocessorCache.ADJUST_SATURATION)
+      return tf.clip_by_value(
+          tf.image.adjust_saturation(image, saturation_factor), 0.0, 1.0)
+
+    def _adjust_hue(image):
+      delta = _get_rand_var(
+          functools.partial(tf.random_uniform, [], -0.2, 0.2),
+          preprocessor_cache.PreprocessorCache.ADJUST_HUE)
+      return tf.clip_by_value(tf.image.adjust_hue(image, delta), 0.0, 1.0)
+
+    def _adjust_contrast(image):
+      contrast_factor = _get_rand_var(
+          functools.partial(tf.random_uniform, [], 0.5, 1.5),
+          preprocessor_cache.PreprocessorCache.ADJUST_CONTRAST)
+      return tf.clip_by_value(
+          tf.image.adjust_contrast(image, contrast_factor), 0.0, 1.0)
 
+    if color_ordering == 0:
+      adjustments = [_adjust_brightness, _adjust_saturation, _adjust_hue,
+                     _adjust_contrast]
     elif color_ordering == 1:
-      image = random_adjust_brightness(
-          image, max_delta=32. / 255.,
-          preprocess_vars_cache=preprocess_vars_cache)
-      image = random_adjust_contrast(
-          image, min_delta=0.5, max_delta=1.5,
-          preprocess_vars_cache=preprocess_vars_cache)
-      image = random_adjust_saturation(
-          image, min_delta=0.5, max_delta=1.5,
-          preprocess_vars_cache=preprocess_vars_cache)
-      image = random_adjust_hue(
-          image, max_delta=0.2,
-          preprocess_vars_cache=preprocess_vars_cache)
+      adjustments = [_adjust_brightness, _adjust_contrast,
+                     _adjust_saturation, _adjust_hue]
     else:
       raise ValueError('color_ordering must be in {0, 1}')
-    return image
+
+    image = image / 255.
+    for adjustment in adjustments:
+      image = adjustment(image)
+    return image * 255.
 
 
 def random_jitter_boxes(boxes, ratio=0.05, seed=None):
@@ -1397,12 +1419,6 @@ def random_crop_image(image,
   if random_coef < sys.float_info.min:
     result = strict_random_crop_image_fn()
   else:
-    generator_func = functools.partial(tf.random_uniform, [], seed=seed)
-    do_a_crop_random = _get_or_create_preprocess_rand_vars(
-        generator_func, preprocessor_cache.PreprocessorCache.CROP_IMAGE,
-        preprocess_vars_cache)
-    do_a_crop_random = tf.greater(do_a_crop_random, random_coef)
-
     outputs = [image, boxes, labels]
 
     if label_weights is not None:
@@ -1416,8 +1432,19 @@ def random_crop_image(image,
     if keypoints is not None:
       outputs.append(keypoints)
 
-    result = tf.cond(do_a_crop_random, strict_random_crop_image_fn,
-                     lambda: tuple(outputs))
+    if random_coef >= 1.0:
+      # Always keeps the original tensors; skips building the crop subgraph
+      # and the tf.cond entirely.
+      result = tuple(outputs)
+    else:
+      generator_func = functools.partial(tf.random_uniform, [], seed=seed)
+      do_a_crop_random = _get_or_create_preprocess_rand_vars(
+          generator_func, preprocessor_cache.PreprocessorCache.CROP_IMAGE,
+          preprocess_vars_cache)
+      do_a_crop_random = tf.greater(do_a_crop_random, random_coef)
+
+      result = tf.cond(do_a_crop_random, strict_random_crop_image_fn,
+                       lambda: tuple(outputs))
   return result
 
 
@@ -1782,8 +1809,15 @@ def random_crop_to_aspect_ratio(image,
         preprocessor_cache.PreprocessorCache.CROP_TO_ASPECT_RATIO,
         preprocess_vars_cache)
 
-    new_image = tf.image.crop_to_bounding_box(
-        image, offset_height, offset_width, target_height, target_width)
+    # When the image already has the requested aspect ratio the crop window
+    # covers the whole image, so skip the full-image copy the crop would make.
+    new_image = tf.cond(
+        tf.logical_and(
+            tf.equal(target_height, orig_height),
+            tf.equal(target_width, orig_width)),
+        lambda: image,
+        lambda: tf.image.crop_to_bounding_box(
+            image, offset_height, offset_width, target_height, target_width))
 
     im_box = tf.stack([
         tf.to_float(offset_height) / tf.to_float(orig_height),
@@ -2072,7 +2106,8 @@ def image_to_float(image):
     image: image in tf.float32 format.
   """
   with tf.name_scope('ImageToFloat', values=[image]):
-    image = tf.to_float(image)
+    if image.dtype != tf.float32:
+      image = tf.to_float(image)
     return image
 
 
@@ -2175,6 +2210,21 @@ def _compute_new_dynamic_size(image, min_dimension, max_dimension):
   return tf.stack(tf.unstack(new_size) + [num_channels])
 
 
+def _shape_tensor(dims):
+  """Returns a 1-D int32 shape tensor, as a single constant if dims are static.
+
+  Args:
+    dims: list of dimensions, each either a Python int or a scalar int tensor.
+
+  Returns:
+    A rank 1 int32 tensor holding dims. When every dimension is a Python int
+    this is one graph constant instead of a stack of scalar tensors.
+  """
+  if all(isinstance(dim, int) for dim in dims):
+    return tf.constant(dims, dtype=tf.int32)
+  return tf.stack(dims)
+
+
 def resize_to_range(image,
                     masks=None,
                     min_dimension=None,
@@ -2182,7 +2232,8 @@ def resize_to_range(image,
                     method=tf.image.ResizeMethod.BILINEAR,
                     align_corners=False,
                     pad_to_max_dimension=False,
-                    per_channel_pad_value=(0, 0, 0)):
+                    per_channel_pad_value=(0, 0, 0),
+                    use_area_for_downsampling=False):
   """Resizes an image so its dimensions are within the provided value.
 
   The output size can be described by two cases:
@@ -2209,6 +2260,10 @@ def resize_to_range(image,
       similarly.
     per_channel_pad_value: A tuple of per-channel scalar value to use for
       padding. By default pads zeros.
+    use_area_for_downsampling: Whether to resize with the AREA method instead
+      of `method` whenever the image is being scaled down. Area resampling
+      averages the contributing input pixels, which avoids the aliasing
+      artifacts bilinear downsampling introduces.
 
   Returns:
     Note that the position of the resized_image_shape changes based on whether
@@ -2233,37 +2288,67 @@ def resize_to_range(image,
       new_size = _compute_new_static_size(image, min_dimension, max_dimension)
     else:
       new_size = _compute_new_dynamic_size(image, min_dimension, max_dimension)
-    new_image = tf.image.resize_images(
-        image, new_size[:-1], method=method, align_corners=align_corners)
+
+    if not use_area_for_downsampling:
+      new_image = tf.image.resize_images(
+          image, new_size[:-1], method=method, align_corners=align_corners)
+    elif image.get_shape().is_fully_defined():
+      # Static shapes allow deciding on the resampling method in Python.
+      static_new_size = tensor_util.constant_value(new_size)
+      resize_method = method
+      if static_new_size[0] < image.get_shape().as_list()[0]:
+        resize_method = tf.image.ResizeMethod.AREA
+      new_image = tf.image.resize_images(
+          image, new_size[:-1], method=resize_method,
+          align_corners=align_corners)
+    else:
+      new_image = tf.cond(
+          tf.less(new_size[0], tf.shape(image)[0]),
+          lambda: tf.image.resize_images(
+              image, new_size[:-1], method=tf.image.ResizeMethod.AREA,
+              align_corners=align_corners),
+          lambda: tf.image.resize_images(
+              image, new_size[:-1], method=method,
+              align_corners=align_corners))
 
     if pad_to_max_dimension:
-      channels = tf.unstack(new_image, axis=2)
-      if len(channels) != len(per_channel_pad_value):
-        raise ValueError('Number of channels must be equal to the length of '
-                         'per-channel pad value.')
-      new_image = tf.stack(
-          [
-              tf.pad(
-                  channels[i], [[0, max_dimension - new_size[0]],
-                                [0, max_dimension - new_size[1]]],
-                  constant_values=per_channel_pad_value[i])
-              for i in range(len(channels))
-          ],
-          axis=2)
+      if all(value == 0 for value in per_channel_pad_value):
+        # Zero padding is the common case and does not need the per-channel
+        # unstack/pad/stack below; pad the whole HWC tensor in one op.
+        new_image = tf.image.pad_to_bounding_box(
+            new_image, 0, 0, max_dimension, max_dimension)
+      else:
+        channels = tf.unstack(new_image, axis=2)
+        if len(channels) != len(per_channel_pad_value):
+          raise ValueError('Number of channels must be equal to the length of '
+                           'per-channel pad value.')
+        new_image = tf.stack(
+            [
+                tf.pad(
+                    channels[i], [[0, max_dimension - new_size[0]],
+                                  [0, max_dimension - new_size[1]]],
+                    constant_values=per_channel_pad_value[i])
+                for i in range(len(channels))
+            ],
+            axis=2)
       new_image.set_shape([max_dimension, max_dimension, 3])
 
     result = [new_image]
     if masks is not None:
+      # The resize kernel needs a rank 4 tensor, but the padding does not;
+      # squeeze the channel axis back out first and pad the
+      # [num_instances, height, width] tensor directly.
       new_masks = tf.expand_dims(masks, 3)
       new_masks = tf.image.resize_images(
           new_masks,
           new_size[:-1],
           method=tf.image.ResizeMethod.NEAREST_NEIGHBOR,
           align_corners=align_corners)
-      if pad_to_max_dimension:
-        new_masks = tf.image.pad_to_bounding_box(
-            new_masks, 0, 0, max_dimension, max_dimension)
       new_masks = tf.squeeze(new_masks, 3)
+      if pad_to_max_dimension:
+        new_masks = tf.pad(
+            new_masks, [[0, 0], [0, max_dimension - new_size[0]],
+                        [0, max_dimension - new_size[1]]])
       result.append(new_masks)
 
     result.append(new_size)
@@ -2299,29 +2384,53 @@ def resize_to_min_dimension(image, masks=None, min_dimension=600):
     raise ValueError('Image should be 3D tensor')
 
   with tf.name_scope('ResizeGivenMinDimension', values=[image, min_dimension]):
-    image_height = tf.shape(image)[0]
-    image_width = tf.shape(image)[1]
-    num_channels = tf.shape(image)[2]
-    min_image_dimension = tf.minimum(image_height, image_width)
-    min_target_dimension = tf.maximum(min_image_dimension, min_dimension)
-    target_ratio = tf.to_float(min_target_dimension) / tf.to_float(
-        min_image_dimension)
-    target_height = tf.to_int32(tf.to_float(image_height) * target_ratio)
-    target_width = tf.to_int32(tf.to_float(image_width) * target_ratio)
-    image = tf.image.resize_bilinear(
-        tf.expand_dims(image, axis=0),
-        size=[target_height, target_width],
-        align_corners=True)
-    result = [tf.squeeze(image, axis=0)]
+    image_shape = shape_utils.combined_static_and_dynamic_shape(image)
+    num_channels = image_shape[2]
+    # When the image is already at least min_dimension on its smaller side, the
+    # resize would be an identity copy of the full image, so skip it. With a
+    # statically known shape the decision is made at graph construction time
+    # and no tf.cond is built at all.
+    if (all(isinstance(dim, int) for dim in image_shape[:2]) and
+        not isinstance(min_dimension, tf.Tensor)):
+      target_ratio = max(float(min_dimension) / min(image_shape[:2]), 1.0)
+      target_height = int(image_shape[0] * target_ratio)
+      target_width = int(image_shape[1] * target_ratio)
+      needs_resize = target_ratio > 1.0
+    else:
+      image_hw = tf.cast(tf.stack(image_shape[:2]), tf.float32)
+      target_ratio = tf.maximum(
+          tf.cast(min_dimension, tf.float32) / tf.reduce_min(image_hw), 1.0)
+      target_size = tf.cast(image_hw * target_ratio, tf.int32)
+      target_height = target_size[0]
+      target_width = target_size[1]
+      needs_resize = tf.greater(target_ratio, 1.0)
+
+    def _resize_image():
+      return tf.squeeze(tf.image.resize_bilinear(
+          tf.expand_dims(image, axis=0),
+          size=[target_height, target_width],
+          align_corners=True), axis=0)
+
+    if isinstance(needs_resize, bool):
+      image = _resize_image() if needs_resize else image
+    else:
+      image = tf.cond(needs_resize, _resize_image, lambda: image)
+    result = [image]
 
     if masks is not None:
-      masks = tf.image.resize_nearest_neighbor(
-          tf.expand_dims(masks, axis=3),
-          size=[target_height, target_width],
-          align_corners=True)
-      result.append(tf.squeeze(masks, axis=3))
+      def _resize_masks():
+        return tf.squeeze(tf.image.resize_nearest_neighbor(
+            tf.expand_dims(masks, axis=3),
+            size=[target_height, target_width],
+            align_corners=True), axis=3)
+
+      if isinstance(needs_resize, bool):
+        masks = _resize_masks() if needs_resize else masks
+      else:
+        masks = tf.cond(needs_resize, _resize_masks, lambda: masks)
+      result.append(masks)
 
-    result.append(tf.stack([target_height, target_width, num_channels]))
+    result.append(_shape_tensor([target_height, target_width, num_channels]))
     return result
 
 
@@ -2346,8 +2455,9 @@ def scale_boxes_to_pixel_coordinates(image, boxes, keypoints=None):
       coordinates.
   """
   boxlist = box_list.BoxList(boxes)
-  image_height = tf.shape(image)[0]
-  image_width = tf.shape(image)[1]
+  image_shape = shape_utils.combined_static_and_dynamic_shape(image)
+  image_height = image_shape[0]
+  image_width = image_shape[1]
   scaled_boxes = box_list_ops.scale(boxlist, image_height, image_width).get()
   result = [image, scaled_boxes]
   if keypoints is not None:
@@ -2397,7 +2507,7 @@ def resize_image(image,
     image_shape = shape_utils.combined_static_and_dynamic_shape(image)
     result = [new_image]
     if masks is not None:
-      num_instances = tf.shape(masks)[0]
+      num_instances = shape_utils.combined_static_and_dynamic_shape(masks)[0]
       new_size = tf.stack([new_height, new_width])
       def resize_masks_branch():
         new_masks = tf.expand_dims(masks, 3)
@@ -2414,11 +2524,16 @@ def resize_image(image,
         new_masks = tf.reshape(masks, [-1, new_size[0], new_size[1]])
         return new_masks
 
-      masks = tf.cond(num_instances > 0, resize_masks_branch,
-                      reshape_masks_branch)
+      if isinstance(num_instances, int):
+        # Statically known instance count; pick the branch in Python.
+        masks = resize_masks_branch() if num_instances > 0 else (
+            reshape_masks_branch())
+      else:
+        masks = tf.cond(num_instances > 0, resize_masks_branch,
+                        reshape_masks_branch)
       result.append(masks)
 
-    result.append(tf.stack([new_height, new_width, image_shape[2]]))
+    result.append(_shape_tensor([new_height, new_width, image_shape[2]]))
     return result
 
 
@@ -2463,8 +2578,14 @@ def one_hot_encoding(labels, num_classes=None):
     if num_classes is None:
       raise ValueError('num_classes must be specified')
 
-    labels = tf.one_hot(labels, num_classes, 1, 0)
-    return tf.reduce_max(labels, 0)
+    # Scattering writes O(num_labels) elements instead of materializing the
+    # [num_labels, num_classes] matrix that one_hot + reduce_max would need.
+    # Repeated labels accumulate under scatter_nd, so clamp back to one.
+    onehot_labels = tf.scatter_nd(
+        indices=tf.expand_dims(labels, 1),
+        updates=tf.ones_like(labels),
+        shape=[num_classes])
+    return tf.minimum(onehot_labels, 1)
 
 
 def rgb_to_gray(image):
@@ -2556,6 +2677,59 @@ def ssd_random_crop(image,
                [num_instances, num_keypoints, 2]
   """
 
+  def _all_cases_equal(params):
+    return all(param == params[0] for param in params)
+
+  # When every selectable case shares the same aspect ratio range, area range,
+  # clipping flag and random coefficient, the per-case parameters that remain
+  # (min_object_covered and overlap_thresh) are scalars that the underlying ops
+  # accept as tensors. A single crop whose parameters are gathered at runtime
+  # then replaces the num_cases-way switch/merge dispatch, so only one crop
+  # subgraph is built instead of one per case. The dispatch path is kept when a
+  # preprocess_vars_cache is provided, since the cache records crop variables
+  # per min_object_covered value.
+  if (preprocess_vars_cache is None and _all_cases_equal(aspect_ratio_range)
+      and _all_cases_equal(area_range) and _all_cases_equal(clip_boxes)
+      and _all_cases_equal(random_coef)):
+    selected_index = tf.random_uniform(
+        [], maxval=len(min_object_covered), dtype=tf.int32, seed=seed)
+    selected_min_object_covered = tf.gather(
+        tf.constant(min_object_covered, dtype=tf.float32), selected_index)
+    selected_overlap_thresh = tf.gather(
+        tf.constant(overlap_thresh, dtype=tf.float32), selected_index)
+    return random_crop_image(
+        image=image,
+        boxes=boxes,
+        labels=labels,
+        label_weights=label_weights,
+        label_confidences=label_confidences,
+        multiclass_scores=multiclass_scores,
+        masks=masks,
+        keypoints=keypoints,
+        min_object_covered=selected_min_object_covered,
+        aspect_ratio_range=aspect_ratio_range[0],
+        area_range=area_range[0],
+        overlap_thresh=selected_overlap_thresh,
+        clip_boxes=clip_boxes[0],
+        random_coef=random_coef[0],
+        seed=seed)
+
+  # Offsets of the optional tensors within the selector tuple, computed once
+  # instead of re-running a counter ladder inside the selector.
+  optional_indices = {}
+  next_index = 3
+  for name, tensor in (('label_weights', label_weights),
+                       ('label_confidences', label_confidences),
+                       ('multiclass_scores', multiclass_scores),
+                       ('masks', masks), ('keypoints', keypoints)):
+    if tensor is not None:
+      optional_indices[name] = next_index
+      next_index += 1
+
+  def _optional(selected_result, name):
+    index = optional_indices.get(name)
+    return selected_result[index] if index is not None else None
+
   def random_crop_selector(selected_result, index):
     """Applies random_crop_image to selected result.
 
@@ -2567,38 +2741,17 @@ def ssd_random_crop(image,
     Returns: A tuple containing image, boxes, labels, keypoints (if not None),
              and masks (if not None).
     """
-
-    i = 3
-    image, boxes, labels = selected_result[:i]
-    selected_label_weights = None
-    selected_label_confidences = None
-    selected_multiclass_scores = None
-    selected_masks = None
-    selected_keypoints = None
-    if label_weights is not None:
-      selected_label_weights = selected_result[i]
-      i += 1
-    if label_confidences is not None:
-      selected_label_confidences = selected_result[i]
-      i += 1
-    if multiclass_scores is not None:
-      selected_multiclass_scores = selected_result[i]
-      i += 1
-    if masks is not None:
-      selected_masks = selected_result[i]
-      i += 1
-    if keypoints is not None:
-      selected_keypoints = selected_result[i]
+    image, boxes, labels = selected_result[:3]
 
     return random_crop_image(
         image=image,
         boxes=boxes,
         labels=labels,
-        label_weights=selected_label_weights,
-        label_confidences=selected_label_confidences,
-        multiclass_scores=selected_multiclass_scores,
-        masks=selected_masks,
-        keypoints=selected_keypoints,
+        label_weights=_optional(selected_result, 'label_weights'),
+        label_confidences=_optional(selected_result, 'label_confidences'),
+        multiclass_scores=_optional(selected_result, 'multiclass_scores'),
+        masks=_optional(selected_result, 'masks'),
+        keypoints=_optional(selected_result, 'keypoints'),
         min_object_covered=min_object_covered[index],
         aspect_ratio_range=aspect_ratio_range[index],
         area_range=area_range[index],
@@ -2619,6 +2772,22 @@ def ssd_random_crop(image,
   return result
 
 
+def _unpack_crop_result(crop_result, optional_names):
+  """Maps a positional crop result onto a dict keyed by field name.
+
+  Args:
+    crop_result: tuple of (image, boxes, labels) followed by one tensor per
+      entry in optional_names, in the same order.
+    optional_names: names of the optional fields present in crop_result, in
+      the order the crop function returns them.
+
+  Returns:
+    A dict with keys 'image', 'boxes', 'labels' and optional_names.
+  """
+  return dict(zip(('image', 'boxes', 'labels') + tuple(optional_names),
+                  crop_result))
+
+
 def ssd_random_crop_pad(image,
                         boxes,
                         labels,
@@ -2690,29 +2859,24 @@ def ssd_random_crop_pad(image,
     new_label_weights: new label weights.
   """
 
+  optional_names = [
+      name for name, tensor in (('label_weights', label_weights),
+                                ('label_confidences', label_confidences),
+                                ('multiclass_scores', multiclass_scores))
+      if tensor is not None
+  ]
+
   def random_crop_pad_selector(image_boxes_labels, index):
     """Random crop preprocessing helper."""
-    i = 3
-    image, boxes, labels = image_boxes_labels[:i]
-    selected_label_weights = None
-    selected_label_confidences = None
-    selected_multiclass_scores = None
-    if label_weights is not None:
-      selected_label_weights = image_boxes_labels[i]
-      i += 1
-    if label_confidences is not None:
-      selected_label_confidences = image_boxes_labels[i]
-      i += 1
-    if multiclass_scores is not None:
-      selected_multiclass_scores = image_boxes_labels[i]
+    selected = _unpack_crop_result(image_boxes_labels, optional_names)
 
     return random_crop_pad_image(
-        image,
-        boxes,
-        labels,
-        label_weights=selected_label_weights,
-        label_confidences=selected_label_confidences,
-        multiclass_scores=selected_multiclass_scores,
+        selected['image'],
+        selected['boxes'],
+        selected['labels'],
+        label_weights=selected.get('label_weights'),
+        label_confidences=selected.get('label_confidences'),
+        multiclass_scores=selected.get('multiclass_scores'),
         min_object_covered=min_object_covered[index],
         aspect_ratio_range=aspect_ratio_range[index],
         area_range=area_range[index],
@@ -2833,37 +2997,23 @@ def ssd_random_crop_fixed_aspect_ratio(
       random_coef=random_coef,
       seed=seed,
       preprocess_vars_cache=preprocess_vars_cache)
-  i = 3
-  new_image, new_boxes, new_labels = crop_result[:i]
-  new_label_weights = None
-  new_label_confidences = None
-  new_multiclass_scores = None
-  new_masks = None
-  new_keypoints = None
-  if label_weights is not None:
-    new_label_weights = crop_result[i]
-    i += 1
-  if label_confidences is not None:
-    new_label_confidences = crop_result[i]
-    i += 1
-  if multiclass_scores is not None:
-    new_multiclass_scores = crop_result[i]
-    i += 1
-  if masks is not None:
-    new_masks = crop_result[i]
-    i += 1
-  if keypoints is not None:
-    new_keypoints = crop_result[i]
+  crop_out = _unpack_crop_result(
+      crop_result,
+      [name for name, tensor in (('label_weights', label_weights),
+                                 ('label_confidences', label_confidences),
+                                 ('multiclass_scores', multiclass_scores),
+                                 ('masks', masks), ('keypoints', keypoints))
+       if tensor is not None])
 
   result = random_crop_to_aspect_ratio(
-      new_image,
-      new_boxes,
-      new_labels,
-      label_weights=new_label_weights,
-      label_confidences=new_label_confidences,
-      multiclass_scores=new_multiclass_scores,
-      masks=new_masks,
-      keypoints=new_keypoints,
+      crop_out['image'],
+      crop_out['boxes'],
+      crop_out['labels'],
+      label_weights=crop_out.get('label_weights'),
+      label_confidences=crop_out.get('label_confidences'),
+      multiclass_scores=crop_out.get('multiclass_scores'),
+      masks=crop_out.get('masks'),
+      keypoints=crop_out.get('keypoints'),
       aspect_ratio=aspect_ratio,
       clip_boxes=clip_boxes,
       seed=seed,
@@ -2977,53 +3127,34 @@ def ssd_random_crop_pad_fixed_aspect_ratio(
       random_coef=random_coef,
       seed=seed,
       preprocess_vars_cache=preprocess_vars_cache)
-  i = 3
-  new_image, new_boxes, new_labels = crop_result[:i]
-  new_label_weights = None
-  new_label_confidences = None
-  new_multiclass_scores = None
-  new_masks = None
-  new_keypoints = None
-  if label_weights is not None:
-    new_label_weights = crop_result[i]
-    i += 1
-  if label_confidences is not None:
-    new_label_confidences = crop_result[i]
-    i += 1
-  if multiclass_scores is not None:
-    new_multiclass_scores = crop_result[i]
-    i += 1
-  if masks is not None:
-    new_masks = crop_result[i]
-    i += 1
-  if keypoints is not None:
-    new_keypoints = crop_result[i]
+  crop_out = _unpack_crop_result(
+      crop_result,
+      [name for name, tensor in (('label_weights', label_weights),
+                                 ('label_confidences', label_confidences),
+                                 ('multiclass_scores', multiclass_scores),
+                                 ('masks', masks), ('keypoints', keypoints))
+       if tensor is not None])
 
   result = random_pad_to_aspect_ratio(
-      new_image,
-      new_boxes,
-      masks=new_masks,
-      keypoints=new_keypoints,
+      crop_out['image'],
+      crop_out['boxes'],
+      masks=crop_out.get('masks'),
+      keypoints=crop_out.get('keypoints'),
       aspect_ratio=aspect_ratio,
       min_padded_size_ratio=min_padded_size_ratio,
       max_padded_size_ratio=max_padded_size_ratio,
       seed=seed,
       preprocess_vars_cache=preprocess_vars_cache)
 
-  result = list(result)
-  i = 3
-  result.insert(2, new_labels)
-  if new_label_weights is not None:
-    result.insert(i, new_label_weights)
-    i += 1
-  if new_label_confidences is not None:
-    result.insert(i, new_label_confidences)
-    i += 1
-  if multiclass_scores is not None:
-    result.insert(i, new_multiclass_scores)
-  result = tuple(result)
+  # result holds image, boxes and the optional masks/keypoints; splice the
+  # label tensors back in between instead of repeatedly inserting into a list.
+  output = [result[0], result[1], crop_out['labels']]
+  for name in ('label_weights', 'label_confidences', 'multiclass_scores'):
+    if name in crop_out:
+      output.append(crop_out[name])
+  output.extend(result[2:])
 
-  return result
+  return tuple(output)
 
 
 def convert_class_logits_to_softmax(multiclass_scores, temperature=1.0):
@@ -3042,13 +3173,64 @@ def convert_class_logits_to_softmax(multiclass_scores, temperature=1.0):
   """
 
   # Multiclass scores must be stored as logits. Apply temp and softmax.
-  multiclass_scores_scaled = tf.divide(
-      multiclass_scores, temperature, name='scale_logits')
-  multiclass_scores = tf.nn.softmax(multiclass_scores_scaled, name='softmax')
+  if temperature != 1.0:
+    multiclass_scores = tf.multiply(
+        multiclass_scores, 1.0 / temperature, name='scale_logits')
+  multiclass_scores = tf.nn.softmax(multiclass_scores, name='softmax')
 
   return multiclass_scores
 
 
+# Preprocessing functions that involve no randomness: given the same inputs
+# they produce the same outputs on every epoch, so their results can be
+# computed once and cached.
+_DETERMINISTIC_FUNCS = frozenset([
+    convert_class_logits_to_softmax,
+    image_to_float,
+    normalize_image,
+    one_hot_encoding,
+    resize_image,
+    resize_to_min_dimension,
+    resize_to_range,
+    retain_boxes_above_threshold,
+    rgb_to_gray,
+    scale_boxes_to_pixel_coordinates,
+    subtract_channel_mean,
+])
+
+
+def split_deterministic_prefix(preprocess_options):
+  """Splits preprocess options into a deterministic prefix and the rest.
+
+  The prefix contains the leading options whose functions involve no
+  randomness and therefore repeat identically every epoch. Running the prefix
+  once and caching its outputs — e.g. with tf.data.Dataset.cache() between
+  two dataset.map calls, or by materializing them to TFRecord — leaves only
+  the stochastic augmentations to recompute at training time.
+
+  Args:
+    preprocess_options: It is a list of tuples, where each tuple contains a
+                        function and a dictionary that contains arguments and
+                        their values.
+
+  Returns:
+    A tuple (deterministic_options, remaining_options) whose concatenation is
+    preprocess_options.
+  """
+  num_deterministic = 0
+  for func, _ in preprocess_options:
+    if func not in _DETERMINISTIC_FUNCS:
+      break
+    num_deterministic += 1
+  return (preprocess_options[:num_deterministic],
+          preprocess_options[num_deterministic:])
+
+
+# Maps the boolean flags of get_default_func_arg_map to the map they produce,
+# so repeated calls with the same flags reuse a single dict.
+_default_func_arg_map_cache = {}
+
+
 def get_default_func_arg_map(include_label_weights=True,
                              include_label_confidences=False,
                              include_multiclass_scores=False,
@@ -3056,6 +3238,9 @@ def get_default_func_arg_map(include_label_weights=True,
                              include_keypoints=False):
   """Returns the default mapping from a preprocessor function to its args.
 
+  There are only 32 possible maps, so they are cached: calls with the same
+  flags return the same dict object, which callers should treat as read-only.
+
   Args:
     include_label_weights: If True, preprocessing functions will modify the
       label weights, too.
@@ -3071,6 +3256,12 @@ def get_default_func_arg_map(include_label_weights=True,
   Returns:
     A map from preprocessing functions to the arguments they receive.
   """
+  cache_key = (include_label_weights, include_label_confidences,
+               include_multiclass_scores, include_instance_masks,
+               include_keypoints)
+  if cache_key in _default_func_arg_map_cache:
+    return _default_func_arg_map_cache[cache_key]
+
   groundtruth_label_weights = None
   if include_label_weights:
     groundtruth_label_weights = (
@@ -3225,13 +3416,180 @@ def get_default_func_arg_map(include_label_weights=True,
       convert_class_logits_to_softmax: (multiclass_scores,),
   }
 
+  _default_func_arg_map_cache[cache_key] = prep_func_arg_map
   return prep_func_arg_map
 
 
+# Caches, per preprocessing function, whether it takes a
+# preprocess_vars_cache argument, so the argspec is inspected at most once.
+_func_accepts_vars_cache = {}
+
+
+def _accepts_preprocess_vars_cache(func):
+  """Returns whether func accepts a preprocess_vars_cache argument."""
+  if func not in _func_accepts_vars_cache:
+    _func_accepts_vars_cache[func] = (
+        'preprocess_vars_cache' in inspect.getargspec(func).args)
+  return _func_accepts_vars_cache[func]
+
+
+def build_preprocess_fn(preprocess_options, func_arg_map=None, device=None):
+  """Builds a reusable preprocessing function for fixed preprocess options.
+
+  The options are validated and each function's argument list and signature
+  are resolved once here, so the returned callable performs no per-call
+  option validation or reflection. It behaves exactly like calling
+  `preprocess` with the same options and is meant to be built once and handed
+  to `tf.data.Dataset.map`, where the whole preprocessing chain is traced
+  into a single graph.
+
+  Args:
+    preprocess_options: It is a list of tuples, where each tuple contains a
+                        function and a dictionary that contains arguments and
+                        their values.
+    func_arg_map: mapping from preprocessing functions to arguments that they
+                  expect to receive and return.
+    device: (optional) device name to place all preprocessing ops on, e.g.
+            '/gpu:0'. If None, the default placement is used.
+
+  Returns:
+    A callable with signature (tensor_dict, preprocess_vars_cache=None)
+    returning the preprocessed tensor_dict.
+
+  Raises:
+    ValueError: If a function in preprocess_options does not exist in
+                func_arg_map.
+  """
+  if func_arg_map is None:
+    func_arg_map = get_default_func_arg_map()
+
+  def _make_step(func, params, arg_names, takes_vars_cache):
+    """Specializes one preprocessing option into a self-contained step."""
+    non_none_arg_names = tuple(
+        arg_name for arg_name in arg_names if arg_name is not None)
+    # C-implemented batch lookup of the non-None args; None placeholders are
+    # spliced back in by position below.
+    fetch_args = (operator.itemgetter(*non_none_arg_names)
+                  if non_none_arg_names else None)
+    has_none_args = len(non_none_arg_names) != len(arg_names)
+
+    def _step(tensor_dict, preprocess_vars_cache):
+      try:
+        fetched = fetch_args(tensor_dict) if fetch_args else ()
+      except KeyError as e:
+        raise ValueError('The function %s requires argument %s' %
+                         (func.__name__, e.args[0]))
+      if len(non_none_arg_names) == 1:
+        fetched = (fetched,)
+      if has_none_args:
+        fetched_iter = iter(fetched)
+        args = [
+            next(fetched_iter) if arg_name is not None else None
+            for arg_name in arg_names
+        ]
+      else:
+        args = fetched
+      call_params = params
+      if preprocess_vars_cache is not None and takes_vars_cache:
+        # Copy instead of mutating params: the compiled function outlives any
+        # one call, and a cache written into the shared dict would silently
+        # replay its random draws on later cache-less calls.
+        call_params = dict(params, preprocess_vars_cache=preprocess_vars_cache)
+      results = func(*args, **call_params)
+      if not isinstance(results, (list, tuple)):
+        results = (results,)
+      # None args are removed since the return values will not contain those.
+      tensor_dict.update(zip(non_none_arg_names, results))
+
+    return _step
+
+  compiled_steps = []
+  image_is_used = False
+  for option in preprocess_options:
+    func, params = option
+    if func not in func_arg_map:
+      raise ValueError('The function %s does not exist in func_arg_map' %
+                       (func.__name__))
+    arg_names = func_arg_map[func]
+    # The squeeze/expand_dims round trip below is only needed when one of the
+    # selected functions actually consumes the image.
+    if fields.InputDataFields.image in (arg_names or ()):
+      image_is_used = True
+    compiled_steps.append(
+        _make_step(func, params, arg_names,
+                   _accepts_preprocess_vars_cache(func)))
+
+  def _apply_steps(tensor_dict, preprocess_vars_cache):
+    # changes the images to image (rank 4 to rank 3) since the functions
+    # receive rank 3 tensor for image
+    if fields.InputDataFields.image in tensor_dict:
+      images = tensor_dict[fields.InputDataFields.image]
+      if len(images.get_shape()) != 4:
+        raise ValueError('images in tensor_dict should be rank 4')
+      if image_is_used:
+        image = tf.squeeze(images, axis=0)
+        tensor_dict[fields.InputDataFields.image] = image
+
+    for step in compiled_steps:
+      step(tensor_dict, preprocess_vars_cache)
+
+    # changes the image to images (rank 3 to rank 4) to be compatible to what
+    # we received in the first place
+    if image_is_used and fields.InputDataFields.image in tensor_dict:
+      image = tensor_dict[fields.InputDataFields.image]
+      images = tf.expand_dims(image, 0)
+      tensor_dict[fields.InputDataFields.image] = images
+
+    return tensor_dict
+
+  def _preprocess_fn(tensor_dict, preprocess_vars_cache=None):
+    """Applies the compiled preprocessing options to tensor_dict."""
+    if device is None:
+      return _apply_steps(tensor_dict, preprocess_vars_cache)
+    with tf.device(device):
+      return _apply_steps(tensor_dict, preprocess_vars_cache)
+
+  return _preprocess_fn
+
+
+def as_map_fn(preprocess_options, func_arg_map=None):
+  """Returns a single-argument callable for use with tf.data.Dataset.map.
+
+  The preprocessing chain is compiled once with build_preprocess_fn, so the
+  per-element function does no option validation or reflection. Recommended
+  usage, which parallelizes augmentation across CPU cores and overlaps it
+  with training:
+
+    dataset = dataset.map(
+        preprocessor.as_map_fn(preprocess_options),
+        num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+  Args:
+    preprocess_options: It is a list of tuples, where each tuple contains a
+                        function and a dictionary that contains arguments and
+                        their values.
+    func_arg_map: mapping from preprocessing functions to arguments that they
+                  expect to receive and return.
+
+  Returns:
+    A callable that takes and returns a tensor_dict, suitable for
+    tf.data.Dataset.map.
+  """
+  preprocess_fn = build_preprocess_fn(preprocess_options, func_arg_map)
+
+  def _map_fn(tensor_dict):
+    return preprocess_fn(tensor_dict)
+
+  return _map_fn
+
+
 def preprocess(tensor_dict,
                preprocess_options,
                func_arg_map=None,
-               preprocess_vars_cache=None):
+               preprocess_vars_cache=None,
+               device=None):
   """Preprocess images and bounding boxes.
 
   Various types of preprocessing (to be implemented) based on the
@@ -3260,6 +3618,8 @@ def preprocess(tensor_dict,
                            performed augmentations. Updated in-place. If this
                            function is called multiple times with the same
                            non-null cache, it will perform deterministically.
+    device: (optional) device name to place all preprocessing ops on, e.g.
+            '/gpu:0'. If None, the default placement is used.
 
   Returns:
     tensor_dict: which contains the preprocessed images, bounding boxes, etc.
@@ -3271,50 +3631,6 @@ def preprocess(tensor_dict,
                     do not exist in tensor_dict.
                 (c) If image in tensor_dict is not rank 4
   """
-  if func_arg_map is None:
-    func_arg_map = get_default_func_arg_map()
-
-  # changes the images to image (rank 4 to rank 3) since the functions
-  # receive rank 3 tensor for image
-  if fields.InputDataFields.image in tensor_dict:
-    images = tensor_dict[fields.InputDataFields.image]
-    if len(images.get_shape()) != 4:
-      raise ValueError('images in tensor_dict should be rank 4')
-    image = tf.squeeze(images, axis=0)
-    tensor_dict[fields.InputDataFields.image] = image
-
-  # Preprocess inputs based on preprocess_options
-  for option in preprocess_options:
-    func, params = option
-    if func not in func_arg_map:
-      raise ValueError('The function %s does not exist in func_arg_map' %
-                       (func.__name__))
-    arg_names = func_arg_map[func]
-    for a in arg_names:
-      if a is not None and a not in tensor_dict:
-        raise ValueError('The function %s requires argument %s' %
-                         (func.__name__, a))
-
-    def get_arg(key):
-      return tensor_dict[key] if key is not None else None
-
-    args = [get_arg(a) for a in arg_names]
-    if (preprocess_vars_cache is not None and
-        'preprocess_vars_cache' in inspect.getargspec(func).args):
-      params['preprocess_vars_cache'] = preprocess_vars_cache
-    results = func(*args, **params)
-    if not isinstance(results, (list, tuple)):
-      results = (results,)
-    # Removes None args since the return values will not contain those.
-    arg_names = [arg_name for arg_name in arg_names if arg_name is not None]
-    for res, arg_name in zip(results, arg_names):
-      tensor_dict[arg_name] = res
-
-  # changes the image to images (rank 3 to rank 4) to be compatible to what
-  # we received in the first place
-  if fields.InputDataFields.image in tensor_dict:
-    image = tensor_dict[fields.InputDataFields.image]
-    images = tf.expand_dims(image, 0)
-    tensor_dict[fields.InputDataFields.image] = images
-
-  return tensor_dict
+  preprocess_fn = build_preprocess_fn(preprocess_options, func_arg_map,
+                                      device=device)
+  return preprocess_fn(tensor_dict, preprocess_vars_cache)
@@ -2573,6 +2573,48 @@ class PreprocessorTest(tf.test.TestCase):
         out_image_shape = sess.run(out_image_shape)
         self.assertAllEqual(out_image_shape, expected_shape)
 
+  def testResizeToRangeUsesAreaWhenStaticallyDownsampling(self):
+    in_image = tf.random_uniform([200, 100, 3])
+    out_image, _ = preprocessor.resize_to_range(
+        in_image, min_dimension=50, max_dimension=100,
+        use_area_for_downsampling=True)
+    op_types = [op.type for op in tf.get_default_graph().get_operations()]
+    self.assertIn('ResizeArea', op_types)
+    self.assertNotIn('ResizeBilinear', op_types)
+    self.assertAllEqual(out_image.get_shape().as_list(), [100, 50, 3])
+
+  def testResizeToRangeKeepsMethodWhenStaticallyUpsampling(self):
+    in_image = tf.random_uniform([30, 20, 3])
+    out_image, _ = preprocessor.resize_to_range(
+        in_image, min_dimension=50, max_dimension=100,
+        use_area_for_downsampling=True)
+    op_types = [op.type for op in tf.get_default_graph().get_operations()]
+    self.assertIn('ResizeBilinear', op_types)
+    self.assertNotIn('ResizeArea', op_types)
+    self.assertAllEqual(out_image.get_shape().as_list(), [75, 50, 3])
+
+  def testResizeToRangeAreaWithDynamicSpatialShape(self):
+    in_image = tf.placeholder(tf.float32, shape=(None, None, 3))
+    out_image, _ = preprocessor.resize_to_range(
+        in_image, min_dimension=50, max_dimension=100,
+        use_area_for_downsampling=True)
+    area_reference = tf.image.resize_images(
+        in_image, [100, 50], method=tf.image.ResizeMethod.AREA)
+    bilinear_reference = tf.image.resize_images(
+        in_image, [75, 50], method=tf.image.ResizeMethod.BILINEAR)
+
+    with self.test_session() as sess:
+      downsampled_input = np.random.rand(200, 100, 3).astype(np.float32)
+      out_image_np, expected_np = sess.run(
+          [out_image, area_reference], feed_dict={in_image: downsampled_input})
+      self.assertAllClose(out_image_np, expected_np)
+
+      upsampled_input = np.random.rand(30, 20, 3).astype(np.float32)
+      out_image_np, expected_np = sess.run(
+          [out_image, bilinear_reference],
+          feed_dict={in_image: upsampled_input})
+      self.assertAllClose(out_image_np, expected_np)
+
   def testResizeToMinDimensionTensorShapes(self):
     in_image_shape_list = [[60, 55, 3], [15, 30, 3]]
     in_masks_shape_list = [[15, 60, 55], [10, 15, 30]]
@@ -2941,6 +2983,108 @@ class PreprocessorTest(tf.test.TestCase):
       self.assertAllClose(converted_multiclass_scores_,
                           expected_converted_multiclass_scores)
 
+  def testPreprocessPlacesOpsOnRequestedDevice(self):
+    preprocess_options = [(preprocessor.normalize_image, {
+        'original_minval': 0,
+        'original_maxval': 255,
+        'target_minval': 0,
+        'target_maxval': 1
+    })]
+    images = tf.constant(np.random.rand(1, 4, 4, 3).astype(np.float32))
+    graph = tf.get_default_graph()
+    num_ops_before = len(graph.get_operations())
+    preprocessor.preprocess({fields.InputDataFields.image: images},
+                            preprocess_options, device='/device:CPU:1')
+    preprocess_ops = graph.get_operations()[num_ops_before:]
+    self.assertTrue(preprocess_ops)
+    for op in preprocess_ops:
+      self.assertEqual(op.device, '/device:CPU:1')
+
+  def testPreprocessWithoutDeviceLeavesPlacementUnconstrained(self):
+    preprocess_options = [(preprocessor.normalize_image, {
+        'original_minval': 0,
+        'original_maxval': 255,
+        'target_minval': 0,
+        'target_maxval': 1
+    })]
+    images = tf.constant(np.random.rand(1, 4, 4, 3).astype(np.float32))
+    graph = tf.get_default_graph()
+    num_ops_before = len(graph.get_operations())
+    preprocessor.preprocess({fields.InputDataFields.image: images},
+                            preprocess_options)
+    preprocess_ops = graph.get_operations()[num_ops_before:]
+    self.assertTrue(preprocess_ops)
+    for op in preprocess_ops:
+      self.assertEqual(op.device, '')
+
+  def testAsMapFnMatchesPreprocess(self):
+    preprocess_options = [(preprocessor.normalize_image, {
+        'original_minval': 0,
+        'original_maxval': 255,
+        'target_minval': 0,
+        'target_maxval': 1
+    })]
+    image_np = np.random.randint(0, 256, size=(1, 4, 4, 3)).astype(np.float32)
+    boxes_np = np.array([[0.1, 0.2, 0.7, 0.8]], dtype=np.float32)
+
+    dataset = tf.data.Dataset.from_tensors({
+        fields.InputDataFields.image: image_np,
+        fields.InputDataFields.groundtruth_boxes: boxes_np,
+    })
+    dataset = dataset.map(preprocessor.as_map_fn(preprocess_options))
+    mapped_tensor_dict = dataset.make_one_shot_iterator().get_next()
+
+    tensor_dict = {
+        fields.InputDataFields.image: tf.constant(image_np),
+        fields.InputDataFields.groundtruth_boxes: tf.constant(boxes_np),
+    }
+    preprocessed_tensor_dict = preprocessor.preprocess(
+        tensor_dict, preprocess_options)
+
+    with self.test_session() as sess:
+      mapped_out, preprocessed_out = sess.run(
+          [mapped_tensor_dict, preprocessed_tensor_dict])
+
+    self.assertEqual(set(mapped_out.keys()), set(preprocessed_out.keys()))
+    for key in preprocessed_out:
+      self.assertAllClose(mapped_out[key], preprocessed_out[key])
+
+  def testSplitDeterministicPrefix(self):
+    preprocess_options = [
+        (preprocessor.normalize_image, {
+            'original_minval': 0,
+            'original_maxval': 255,
+            'target_minval': 0,
+            'target_maxval': 1
+        }),
+        (preprocessor.rgb_to_gray, {}),
+        (preprocessor.random_horizontal_flip, {}),
+        (preprocessor.resize_to_range, {
+            'min_dimension': 50,
+            'max_dimension': 100
+        }),
+    ]
+    deterministic_options, remaining_options = (
+        preprocessor.split_deterministic_prefix(preprocess_options))
+    self.assertEqual(deterministic_options, preprocess_options[:2])
+    self.assertEqual(remaining_options, preprocess_options[2:])
+
+  def testSplitDeterministicPrefixWithStochasticFirstOption(self):
+    preprocess_options = [
+        (preprocessor.random_horizontal_flip, {}),
+        (preprocessor.rgb_to_gray, {}),
+    ]
+    deterministic_options, remaining_options = (
+        preprocessor.split_deterministic_prefix(preprocess_options))
+    self.assertEqual(deterministic_options, [])
+    self.assertEqual(remaining_options, preprocess_options)
+
+  def testSplitDeterministicPrefixWithEmptyOptions(self):
+    deterministic_options, remaining_options = (
+        preprocessor.split_deterministic_prefix([]))
+    self.assertEqual(deterministic_options, [])
+    self.assertEqual(remaining_options, [])
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -25,8 +25,10 @@ of final feature maps.
 """
 import collections
 import functools
+import numpy as np
 import tensorflow as tf
 from utils import ops
+from utils import shape_utils
 slim = tf.contrib.slim
 
 
@@ -134,8 +136,15 @@ class KerasMultiResolutionFeatureMaps(tf.keras.Model):
 
     self.feature_map_layout = feature_map_layout
     self.convolutions = []
+    # Output dict keys, recorded at construction time so that call() does not
+    # have to look layer names back up on every invocation.
+    self._feature_map_names = []
 
     depth_fn = get_depth_fn(depth_multiplier, min_depth)
+    # The depths only depend on the layout, so compute them once up front
+    # instead of calling depth_fn for every name and layer in the loop below.
+    depths = [depth_fn(d) for d in feature_map_layout['layer_depth']]
+    half_depths = [depth_fn(d / 2) for d in feature_map_layout['layer_depth']]
 
     base_from_layer = ''
     use_explicit_padding = False
@@ -152,11 +161,12 @@ class KerasMultiResolutionFeatureMaps(tf.keras.Model):
         conv_kernel_size = feature_map_layout['conv_kernel_size'][index]
       if from_layer:
         base_from_layer = from_layer
+        self._feature_map_names.append(from_layer)
       else:
         if insert_1x1_conv:
           layer_name = '{}_1_Conv2d_{}_1x1_{}'.format(
-              base_from_layer, index, depth_fn(layer_depth / 2))
-          net.append(tf.keras.layers.Conv2D(depth_fn(layer_depth / 2),
+              base_from_layer, index, half_depths[index])
+          net.append(tf.keras.layers.Conv2D(half_depths[index],
                                             [1, 1],
                                             padding='SAME',
                                             strides=1,
@@ -172,17 +182,20 @@ class KerasMultiResolutionFeatureMaps(tf.keras.Model):
 
         layer_name = '{}_2_Conv2d_{}_{}x{}_s2_{}'.format(
             base_from_layer, index, conv_kernel_size, conv_kernel_size,
-            depth_fn(layer_depth))
+            depths[index])
         stride = 2
         padding = 'SAME'
         if use_explicit_padding:
           padding = 'VALID'
-          # We define this function here while capturing the value of
-          # conv_kernel_size, to avoid holding a reference to the loop variable
-          # conv_kernel_size inside of a lambda function
-          def fixed_padding(features, kernel_size=conv_kernel_size):
-            return ops.fixed_padding(features, kernel_size)
-          net.append(tf.keras.layers.Lambda(fixed_padding))
+          # Matches ops.fixed_padding: a total of conv_kernel_size - 1 pixels
+          # of padding per spatial dimension, expressed as a static
+          # ZeroPadding2D layer instead of a python Lambda so the padding is
+          # a plain graph op with constant paddings.
+          pad_total = conv_kernel_size - 1
+          pad_beg = pad_total // 2
+          pad_end = pad_total - pad_beg
+          net.append(tf.keras.layers.ZeroPadding2D(
+              padding=[[pad_beg, pad_end], [pad_beg, pad_end]]))
         # TODO(rathodv): Add some utilities to simplify the creation of
         # Depthwise & non-depthwise convolutions w/ normalization & activations
         if use_depthwise:
@@ -201,7 +214,7 @@ class KerasMultiResolutionFeatureMaps(tf.keras.Model):
               conv_hyperparams.build_activation_layer(
                   name=layer_name + '_depthwise'))
 
-          net.append(tf.keras.layers.Conv2D(depth_fn(layer_depth), [1, 1],
+          net.append(tf.keras.layers.Conv2D(depths[index], [1, 1],
                                             padding='SAME',
                                             strides=1,
                                             name=layer_name + '_conv',
@@ -216,7 +229,7 @@ class KerasMultiResolutionFeatureMaps(tf.keras.Model):
 
         else:
           net.append(tf.keras.layers.Conv2D(
-              depth_fn(layer_depth),
+              depths[index],
               [conv_kernel_size, conv_kernel_size],
               padding=padding,
               strides=stride,
@@ -230,10 +243,64 @@ class KerasMultiResolutionFeatureMaps(tf.keras.Model):
               conv_hyperparams.build_activation_layer(
                   name=layer_name))
 
+        self._feature_map_names.append(layer_name)
+
       # Until certain bugs are fixed in checkpointable lists,
       # this net must be appended only once it's been filled with layers
       self.convolutions.append(net)
 
+  def fuse_batchnorm_for_inference(self):
+    """Folds the batch norm layers into the preceding convolutions.
+
+    At inference time batch norm is a fixed per-channel affine transform, so
+    its scale and offset can be absorbed into the kernel and bias of the
+    convolution feeding it, which removes one full pass over every generated
+    feature map per stage. The model must have been built (called at least
+    once) before fusing, and the fused model should only be used for
+    inference since the folded batch norm statistics no longer update.
+    """
+    for net in self.convolutions:
+      index = 1
+      while index < len(net):
+        conv = net[index - 1]
+        batchnorm = net[index]
+        if (isinstance(batchnorm, tf.keras.layers.BatchNormalization) and
+            isinstance(conv, tf.keras.layers.Conv2D)):
+          net[index - 1] = self._fuse_conv_batchnorm(conv, batchnorm)
+          del net[index]
+        else:
+          index += 1
+
+  def _fuse_conv_batchnorm(self, conv, batchnorm):
+    """Returns a copy of conv with batchnorm's affine transform folded in."""
+    weights = conv.get_weights()
+    kernel = weights[0]
+    bias = weights[1] if len(weights) > 1 else 0.0
+    gamma = (tf.keras.backend.get_value(batchnorm.gamma)
+             if batchnorm.scale else 1.0)
+    beta = (tf.keras.backend.get_value(batchnorm.beta)
+            if batchnorm.center else 0.0)
+    mean = tf.keras.backend.get_value(batchnorm.moving_mean)
+    variance = tf.keras.backend.get_value(batchnorm.moving_variance)
+    scale = gamma / np.sqrt(variance + batchnorm.epsilon)
+
+    if isinstance(conv, tf.keras.layers.DepthwiseConv2D):
+      # Depthwise kernels are laid out as [height, width, in_channels,
+      # channel_multiplier] while the batch norm channels run over
+      # in_channels * channel_multiplier.
+      fused_kernel = kernel * scale.reshape(kernel.shape[2:])
+    else:
+      fused_kernel = kernel * scale
+    fused_bias = (bias - mean) * scale + beta
+
+    config = conv.get_config()
+    config['name'] = config['name'] + '_fused'
+    config['use_bias'] = True
+    fused_conv = type(conv).from_config(config)
+    fused_conv.build(conv.input_shape)
+    fused_conv.set_weights([fused_kernel, fused_bias])
+    return fused_conv
+
   def call(self, image_features):
     """Generate the multi-resolution feature maps.
 
@@ -253,16 +320,13 @@ class KerasMultiResolutionFeatureMaps(tf.keras.Model):
     for index, from_layer in enumerate(self.feature_map_layout['from_layer']):
       if from_layer:
         feature_map = image_features[from_layer]
-        feature_map_keys.append(from_layer)
       else:
         feature_map = feature_maps[-1]
         for layer in self.convolutions[index]:
           feature_map = layer(feature_map)
-        layer_name = self.convolutions[index][-1].name
-        feature_map_keys.append(layer_name)
+      feature_map_keys.append(self._feature_map_names[index])
       feature_maps.append(feature_map)
-    return collections.OrderedDict(
-        [(x, y) for (x, y) in zip(feature_map_keys, feature_maps)])
+    return collections.OrderedDict(zip(feature_map_keys, feature_maps))
 
 
 def multi_resolution_feature_maps(feature_map_layout, depth_multiplier,
@@ -340,6 +404,10 @@ def multi_resolution_feature_maps(feature_map_layout, depth_multiplier,
       as specified.
   """
   depth_fn = get_depth_fn(depth_multiplier, min_depth)
+  # The depths only depend on the layout, so compute them once up front
+  # instead of calling depth_fn for every name and layer in the loop below.
+  depths = [depth_fn(d) for d in feature_map_layout['layer_depth']]
+  half_depths = [depth_fn(d / 2) for d in feature_map_layout['layer_depth']]
 
   feature_map_keys = []
   feature_maps = []
@@ -361,20 +429,20 @@ def multi_resolution_feature_maps(feature_map_layout, depth_multiplier,
       feature_map_keys.append(from_layer)
     else:
       pre_layer = feature_maps[-1]
-      pre_layer_depth = pre_layer.get_shape().as_list()[3]
+      pre_layer_depth = pre_layer.shape[3]
       intermediate_layer = pre_layer
       if insert_1x1_conv:
         layer_name = '{}_1_Conv2d_{}_1x1_{}'.format(
-            base_from_layer, index, depth_fn(layer_depth / 2))
+            base_from_layer, index, half_depths[index])
         intermediate_layer = slim.conv2d(
             pre_layer,
-            depth_fn(layer_depth / 2), [1, 1],
+            half_depths[index], [1, 1],
             padding='SAME',
             stride=1,
             scope=layer_name)
       layer_name = '{}_2_Conv2d_{}_{}x{}_s2_{}'.format(
           base_from_layer, index, conv_kernel_size, conv_kernel_size,
-          depth_fn(layer_depth))
+          depths[index])
       stride = 2
       padding = 'SAME'
       if use_explicit_padding:
@@ -391,11 +459,11 @@ def multi_resolution_feature_maps(feature_map_layout, depth_multiplier,
             scope=layer_name + '_depthwise')
         feature_map = slim.conv2d(
             feature_map,
-            depth_fn(layer_depth), [1, 1],
+            depths[index], [1, 1],
             padding='SAME',
             stride=1,
             scope=layer_name)
-        if pool_residual and pre_layer_depth == depth_fn(layer_depth):
+        if pool_residual and pre_layer_depth == depths[index]:
           feature_map += slim.avg_pool2d(
               pre_layer, [3, 3],
               padding='SAME',
@@ -404,14 +472,38 @@ def multi_resolution_feature_maps(feature_map_layout, depth_multiplier,
       else:
         feature_map = slim.conv2d(
             intermediate_layer,
-            depth_fn(layer_depth), [conv_kernel_size, conv_kernel_size],
+            depths[index], [conv_kernel_size, conv_kernel_size],
             padding=padding,
             stride=stride,
             scope=layer_name)
       feature_map_keys.append(layer_name)
     feature_maps.append(feature_map)
-  return collections.OrderedDict(
-      [(x, y) for (x, y) in zip(feature_map_keys, feature_maps)])
+  return collections.OrderedDict(zip(feature_map_keys, feature_maps))
+
+
+def _nearest_neighbor_upsampling_add(top_down, residual):
+  """Fuses 2x nearest neighbor upsampling of top_down with a residual add.
+
+  Equivalent to ops.nearest_neighbor_upsampling(top_down, scale=2) followed
+  by adding residual, but expressed as one broadcasting add against a
+  reshaped view of residual, so the upsampled tensor is never materialized.
+
+  Args:
+    top_down: a float32 tensor of size [batch, height, width, channels].
+    residual: a float32 tensor of size [batch, 2 * height, 2 * width,
+      channels].
+
+  Returns:
+    A float32 tensor of size [batch, 2 * height, 2 * width, channels].
+  """
+  with tf.name_scope('nearest_neighbor_upsampling_add'):
+    (batch_size, height, width,
+     channels) = shape_utils.combined_static_and_dynamic_shape(top_down)
+    output = tf.reshape(
+        residual, [batch_size, height, 2, width, 2, channels]) + tf.reshape(
+            top_down, [batch_size, height, 1, width, 1, channels])
+    return tf.reshape(output,
+                      [batch_size, height * 2, width * 2, channels])
 
 
 def fpn_top_down_feature_maps(image_features,
@@ -453,21 +545,23 @@ def fpn_top_down_feature_maps(image_features,
       output_feature_map_keys.append(
           'top_down_%s' % image_features[-1][0])
 
+      if use_depthwise:
+        conv_op = functools.partial(slim.separable_conv2d, depth_multiplier=1)
+      else:
+        conv_op = slim.conv2d
       for level in reversed(range(num_levels - 1)):
-        top_down = ops.nearest_neighbor_upsampling(top_down, 2)
         residual = slim.conv2d(
             image_features[level][1], depth, [1, 1],
             activation_fn=None, normalizer_fn=None,
             scope='projection_%d' % (level + 1))
         if use_explicit_padding:
+          top_down = ops.nearest_neighbor_upsampling(top_down, 2)
           # slice top_down to the same shape as residual
           residual_shape = tf.shape(residual)
           top_down = top_down[:, :residual_shape[1], :residual_shape[2], :]
-        top_down += residual
-        if use_depthwise:
-          conv_op = functools.partial(slim.separable_conv2d, depth_multiplier=1)
+          top_down += residual
         else:
-          conv_op = slim.conv2d
+          top_down = _nearest_neighbor_upsampling_add(top_down, residual)
         if use_explicit_padding:
           top_down = ops.fixed_padding(top_down, kernel_size)
         output_feature_maps_list.append(conv_op(
@@ -475,12 +569,14 @@ def fpn_top_down_feature_maps(image_features,
             depth, [kernel_size, kernel_size],
             scope='smoothing_%d' % (level + 1)))
         output_feature_map_keys.append('top_down_%s' % image_features[level][0])
-      return collections.OrderedDict(reversed(
-          list(zip(output_feature_map_keys, output_feature_maps_list))))
+      return collections.OrderedDict(
+          zip(reversed(output_feature_map_keys),
+              reversed(output_feature_maps_list)))
 
 
 def pooling_pyramid_feature_maps(base_feature_map_depth, num_layers,
-                                 image_features, replace_pool_with_conv=False):
+                                 image_features, replace_pool_with_conv=False,
+                                 insert_tpu_compat_pool=True):
   """Generates pooling pyramid feature maps.
 
   The pooling pyramid feature maps is motivated by
@@ -506,6 +602,10 @@ def pooling_pyramid_feature_maps(base_feature_map_depth, num_layers,
       feature extractor.
     replace_pool_with_conv: Whether or not to replace pooling operations with
       convolutions in the PPN. Default is False.
+    insert_tpu_compat_pool: Whether to insert the no-op 1x1 max pool after the
+      base convolution that TPU v1 needs (see the comment below). On GPU/CPU
+      the no-op is a wasted pass over the base feature map and can be
+      disabled.
 
   Returns:
     feature_maps: an OrderedDict mapping keys (feature map names) to
@@ -515,7 +615,7 @@ def pooling_pyramid_feature_maps(base_feature_map_depth, num_layers,
   """
   if len(image_features) != 1:
     raise ValueError('image_features should be a dictionary of length 1.')
-  image_features = image_features[image_features.keys()[0]]
+  image_features = next(iter(image_features.values()))
 
   feature_map_keys = []
   feature_maps = []
@@ -530,8 +630,10 @@ def pooling_pyramid_feature_maps(base_feature_map_depth, num_layers,
     # TPU v1 compatibility.  Without the following dummy op, TPU runtime
     # compiler will combine the convolution with one max-pooling below into a
     # single cycle, so getting the conv2d feature becomes impossible.
-    image_features = slim.max_pool2d(
-        image_features, [1, 1], padding='SAME', stride=1, scope=feature_map_key)
+    if insert_tpu_compat_pool:
+      image_features = slim.max_pool2d(
+          image_features, [1, 1], padding='SAME', stride=1,
+          scope=feature_map_key)
   feature_map_keys.append(feature_map_key)
   feature_maps.append(image_features)
   feature_map = image_features
@@ -552,5 +654,4 @@ def pooling_pyramid_feature_maps(base_feature_map_depth, num_layers,
             feature_map, [2, 2], padding='SAME', scope=feature_map_key)
         feature_map_keys.append(feature_map_key)
         feature_maps.append(feature_map)
-  return collections.OrderedDict(
-      [(x, y) for (x, y) in zip(feature_map_keys, feature_maps)])
+  return collections.OrderedDict(zip(feature_map_keys, feature_maps))
@@ -17,6 +17,7 @@
 
 from absl.testing import parameterized
 
+import numpy as np
 import tensorflow as tf
 
 from google.protobuf import text_format
@@ -300,6 +301,90 @@ class MultiResolutionFeatureMapGeneratorTest(tf.test.TestCase):
   # TODO(kaftan): Remove conditional after CMLE moves to TF 1.10
 
 
+class FuseBatchnormForInferenceTest(tf.test.TestCase):
+
+  def _build_conv_hyperparams(self):
+    conv_hyperparams = hyperparams_pb2.Hyperparams()
+    conv_hyperparams_text_proto = """
+      regularizer {
+        l2_regularizer {
+        }
+      }
+      initializer {
+        truncated_normal_initializer {
+        }
+      }
+    """
+    text_format.Merge(conv_hyperparams_text_proto, conv_hyperparams)
+    return hyperparams_builder.KerasLayerHyperparams(conv_hyperparams)
+
+  def _build_feature_map_generator(self, feature_map_layout):
+    # is_training=False so the batch norms normalize with their moving
+    # statistics, which is the regime the folded weights reproduce.
+    return feature_map_generators.KerasMultiResolutionFeatureMaps(
+        feature_map_layout=feature_map_layout,
+        depth_multiplier=1,
+        min_depth=32,
+        insert_1x1_conv=True,
+        freeze_batchnorm=False,
+        is_training=False,
+        conv_hyperparams=self._build_conv_hyperparams(),
+        name='FeatureMaps')
+
+  def _randomize_batchnorm_layers(self, feature_map_generator):
+    # Freshly initialized batch norms are identity-like (zero means, unit
+    # variances), which would make the fusion trivially correct; give every
+    # batch norm parameter a nontrivial value first.
+    for net in feature_map_generator.convolutions:
+      for layer in net:
+        if isinstance(layer, tf.keras.layers.BatchNormalization):
+          layer.set_weights([
+              np.random.uniform(0.5, 1.5, size=weights.shape).astype(
+                  np.float32) for weights in layer.get_weights()
+          ])
+
+  def _check_fusing_preserves_outputs(self, feature_map_layout):
+    image_features = {
+        'Mixed_5c': tf.constant(np.random.rand(4, 7, 7, 64).astype(np.float32))
+    }
+    feature_map_generator = self._build_feature_map_generator(
+        feature_map_layout)
+    feature_maps = feature_map_generator(image_features)
+
+    with self.test_session() as sess:
+      tf.keras.backend.set_session(sess)
+      sess.run(tf.global_variables_initializer())
+      self._randomize_batchnorm_layers(feature_map_generator)
+      out_feature_maps = sess.run(feature_maps)
+
+      feature_map_generator.fuse_batchnorm_for_inference()
+      for net in feature_map_generator.convolutions:
+        for layer in net:
+          self.assertNotIsInstance(layer, tf.keras.layers.BatchNormalization)
+
+      fused_feature_maps = feature_map_generator(image_features)
+      out_fused_feature_maps = sess.run(fused_feature_maps)
+
+    for key, feature_map in out_feature_maps.items():
+      self.assertAllClose(feature_map, out_fused_feature_maps[key],
+                          rtol=1e-4, atol=1e-4)
+
+  def test_fused_outputs_match_unfused_outputs(self):
+    feature_map_layout = {
+        'from_layer': ['Mixed_5c', '', ''],
+        'layer_depth': [-1, 128, 64],
+    }
+    self._check_fusing_preserves_outputs(feature_map_layout)
+
+  def test_fused_outputs_match_unfused_outputs_with_depthwise(self):
+    feature_map_layout = {
+        'from_layer': ['Mixed_5c', '', ''],
+        'layer_depth': [-1, 128, 64],
+        'use_depthwise': True,
+    }
+    self._check_fusing_preserves_outputs(feature_map_layout)
+
+
 class FPNFeatureMapGeneratorTest(tf.test.TestCase):
 
   def test_get_expected_feature_map_shapes(self):
@@ -413,6 +498,55 @@ class PoolingPyramidFeatureMapGeneratorTest(tf.test.TestCase):
         self.assertDictEqual(expected_pool_feature_map_shapes,
                              out_feature_map_shapes)
 
+  def test_get_expected_feature_map_shapes_without_tpu_compat_pool(
+      self, replace_pool_with_conv):
+    image_features = {
+        'image_features': tf.random_uniform([4, 19, 19, 1024])
+    }
+    feature_maps = feature_map_generators.pooling_pyramid_feature_maps(
+        base_feature_map_depth=1024,
+        num_layers=6,
+        image_features=image_features,
+        replace_pool_with_conv=replace_pool_with_conv,
+        insert_tpu_compat_pool=False)
+
+    # The no-op 1x1 max pool after the base convolution must not be emitted.
+    self.assertFalse([
+        op for op in tf.get_default_graph().get_operations()
+        if op.name.startswith('Base_Conv2d_1x1_1024/MaxPool')
+    ])
+
+    expected_pool_feature_map_shapes = {
+        'Base_Conv2d_1x1_1024': (4, 19, 19, 1024),
+        'MaxPool2d_0_2x2': (4, 10, 10, 1024),
+        'MaxPool2d_1_2x2': (4, 5, 5, 1024),
+        'MaxPool2d_2_2x2': (4, 3, 3, 1024),
+        'MaxPool2d_3_2x2': (4, 2, 2, 1024),
+        'MaxPool2d_4_2x2': (4, 1, 1, 1024),
+    }
+
+    expected_conv_feature_map_shapes = {
+        'Base_Conv2d_1x1_1024': (4, 19, 19, 1024),
+        'Conv2d_0_3x3_s2_1024': (4, 10, 10, 1024),
+        'Conv2d_1_3x3_s2_1024': (4, 5, 5, 1024),
+        'Conv2d_2_3x3_s2_1024': (4, 3, 3, 1024),
+        'Conv2d_3_3x3_s2_1024': (4, 2, 2, 1024),
+        'Conv2d_4_3x3_s2_1024': (4, 1, 1, 1024),
+    }
+
+    init_op = tf.global_variables_initializer()
+    with self.test_session() as sess:
+      sess.run(init_op)
+      out_feature_maps = sess.run(feature_maps)
+      out_feature_map_shapes = {key: value.shape
+                                for key, value in out_feature_maps.items()}
+      if replace_pool_with_conv:
+        self.assertDictEqual(expected_conv_feature_map_shapes,
+                             out_feature_map_shapes)
+      else:
+        self.assertDictEqual(expected_pool_feature_map_shapes,
+                             out_feature_map_shapes)
+
   def test_get_expected_variable_names(self, replace_pool_with_conv):
     image_features = {
         'image_features': tf.random_uniform([4, 19, 19, 1024])
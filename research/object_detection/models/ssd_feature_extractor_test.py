@@ -151,13 +151,23 @@ class SsdFeatureExtractorTestBase(test_case.TestCase):
     for variable in variables:
       self.assertTrue(variable.name.startswith(scope_name))
 
+  # Maps (test class name, depth_multiplier, pad_to_multiple, use_keras) to
+  # the variables collected from a throwaway graph, so that multiple test
+  # methods asserting on the same configuration build the extractor once.
+  _variables_cache = {}
+
   def get_feature_extractor_variables(
       self, depth_multiplier, pad_to_multiple, use_keras=False):
-    g = tf.Graph()
-    with g.as_default():
-      preprocessed_inputs = tf.placeholder(tf.float32, (4, None, None, 3))
-      self._extract_features(preprocessed_inputs,
-                             depth_multiplier,
-                             pad_to_multiple,
-                             use_keras=use_keras)
-      return g.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+    cache_key = (type(self).__name__, depth_multiplier, pad_to_multiple,
+                 use_keras)
+    if cache_key not in self._variables_cache:
+      g = tf.Graph()
+      with g.as_default():
+        preprocessed_inputs = tf.placeholder(tf.float32, (4, None, None, 3))
+        self._extract_features(preprocessed_inputs,
+                               depth_multiplier,
+                               pad_to_multiple,
+                               use_keras=use_keras)
+        self._variables_cache[cache_key] = g.get_collection(
+            tf.GraphKeys.GLOBAL_VARIABLES)
+    return self._variables_cache[cache_key]
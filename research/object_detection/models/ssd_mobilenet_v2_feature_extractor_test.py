@@ -14,8 +14,6 @@
 # ==============================================================================
 
 """Tests for ssd_mobilenet_v2_feature_extractor."""
-from absl.testing import parameterized
-
 import numpy as np
 import tensorflow as tf
 
@@ -26,17 +24,31 @@ from models import ssd_mobilenet_v2_keras_feature_extractor
 slim = tf.contrib.slim
 
 
-@parameterized.parameters(
-    {'use_keras': False},
-    {'use_keras': True},
-)
-class SsdMobilenetV2FeatureExtractorTest(
-    ssd_feature_extractor_test.SsdFeatureExtractorTestBase):
+class SsdMobilenetV2FeatureExtractorTestBase(object):
+  """Tests shared by the slim and keras MobilenetV2 extractor variants.
+
+  This mixin intentionally does not derive from SsdFeatureExtractorTestBase
+  so that it is not collected as a test case itself; the concrete subclasses
+  below mix both in and fix _use_keras, which lets test runners shard the
+  two variants into separate processes.
+  """
+
+  _use_keras = False
+
+  @classmethod
+  def setUpClass(cls):
+    super(SsdMobilenetV2FeatureExtractorTestBase, cls).setUpClass()
+    cls._extractor_cache = {}
 
   def _create_feature_extractor(self, depth_multiplier, pad_to_multiple,
                                 use_explicit_padding=False, use_keras=False):
     """Constructs a new feature extractor.
 
+    The slim-based extractor holds no graph state, so one instance per
+    configuration is cached on the class and shared across test methods. The
+    keras-based extractor owns layers bound to the enclosing graph and is
+    rebuilt on every call.
+
     Args:
       depth_multiplier: float depth multiplier for feature extractor
       pad_to_multiple: the nearest multiple to zero pad the input height and
@@ -63,15 +75,19 @@ class SsdMobilenetV2FeatureExtractorTest(
                   use_explicit_padding=use_explicit_padding,
                   name='MobilenetV2'))
     else:
-      return ssd_mobilenet_v2_feature_extractor.SSDMobileNetV2FeatureExtractor(
-          False,
-          depth_multiplier,
-          min_depth,
-          pad_to_multiple,
-          self.conv_hyperparams_fn,
-          use_explicit_padding=use_explicit_padding)
-
-  def test_extract_features_returns_correct_shapes_128(self, use_keras):
+      cache_key = (depth_multiplier, pad_to_multiple, use_explicit_padding)
+      if cache_key not in self._extractor_cache:
+        self._extractor_cache[cache_key] = (
+            ssd_mobilenet_v2_feature_extractor.SSDMobileNetV2FeatureExtractor(
+                False,
+                depth_multiplier,
+                min_depth,
+                pad_to_multiple,
+                self.conv_hyperparams_fn,
+                use_explicit_padding=use_explicit_padding))
+      return self._extractor_cache[cache_key]
+
+  def test_extract_features_returns_correct_shapes_128(self):
     image_height = 128
     image_width = 128
     depth_multiplier = 1.0
@@ -81,10 +97,9 @@ class SsdMobilenetV2FeatureExtractorTest(
                                   (2, 1, 1, 256), (2, 1, 1, 128)]
     self.check_extract_features_returns_correct_shape(
         2, image_height, image_width, depth_multiplier, pad_to_multiple,
-        expected_feature_map_shape, use_keras=use_keras)
+        expected_feature_map_shape, use_keras=self._use_keras)
 
-  def test_extract_features_returns_correct_shapes_128_explicit_padding(
-      self, use_keras):
+  def test_extract_features_returns_correct_shapes_128_explicit_padding(self):
     image_height = 128
     image_width = 128
     depth_multiplier = 1.0
@@ -95,10 +110,9 @@ class SsdMobilenetV2FeatureExtractorTest(
     self.check_extract_features_returns_correct_shape(
         2, image_height, image_width, depth_multiplier, pad_to_multiple,
         expected_feature_map_shape, use_explicit_padding=True,
-        use_keras=use_keras)
+        use_keras=self._use_keras)
 
-  def test_extract_features_returns_correct_shapes_with_dynamic_inputs(
-      self, use_keras):
+  def test_extract_features_returns_correct_shapes_with_dynamic_inputs(self):
     image_height = 128
     image_width = 128
     depth_multiplier = 1.0
@@ -108,9 +122,9 @@ class SsdMobilenetV2FeatureExtractorTest(
                                   (2, 1, 1, 256), (2, 1, 1, 128)]
     self.check_extract_features_returns_correct_shapes_with_dynamic_inputs(
         2, image_height, image_width, depth_multiplier, pad_to_multiple,
-        expected_feature_map_shape, use_keras=use_keras)
+        expected_feature_map_shape, use_keras=self._use_keras)
 
-  def test_extract_features_returns_correct_shapes_299(self, use_keras):
+  def test_extract_features_returns_correct_shapes_299(self):
     image_height = 299
     image_width = 299
     depth_multiplier = 1.0
@@ -120,10 +134,9 @@ class SsdMobilenetV2FeatureExtractorTest(
                                   (2, 2, 2, 256), (2, 1, 1, 128)]
     self.check_extract_features_returns_correct_shape(
         2, image_height, image_width, depth_multiplier, pad_to_multiple,
-        expected_feature_map_shape, use_keras=use_keras)
+        expected_feature_map_shape, use_keras=self._use_keras)
 
-  def test_extract_features_returns_correct_shapes_enforcing_min_depth(
-      self, use_keras):
+  def test_extract_features_returns_correct_shapes_enforcing_min_depth(self):
     image_height = 299
     image_width = 299
     depth_multiplier = 0.5**12
@@ -133,10 +146,9 @@ class SsdMobilenetV2FeatureExtractorTest(
                                   (2, 2, 2, 32), (2, 1, 1, 32)]
     self.check_extract_features_returns_correct_shape(
         2, image_height, image_width, depth_multiplier, pad_to_multiple,
-        expected_feature_map_shape, use_keras=use_keras)
+        expected_feature_map_shape, use_keras=self._use_keras)
 
-  def test_extract_features_returns_correct_shapes_with_pad_to_multiple(
-      self, use_keras):
+  def test_extract_features_returns_correct_shapes_with_pad_to_multiple(self):
     image_height = 299
     image_width = 299
     depth_multiplier = 1.0
@@ -146,56 +158,57 @@ class SsdMobilenetV2FeatureExtractorTest(
                                   (2, 2, 2, 256), (2, 1, 1, 128)]
     self.check_extract_features_returns_correct_shape(
         2, image_height, image_width, depth_multiplier, pad_to_multiple,
-        expected_feature_map_shape, use_keras=use_keras)
+        expected_feature_map_shape, use_keras=self._use_keras)
 
-  def test_extract_features_raises_error_with_invalid_image_size(
-      self, use_keras):
+  def test_extract_features_raises_error_with_invalid_image_size(self):
     image_height = 32
     image_width = 32
     depth_multiplier = 1.0
     pad_to_multiple = 1
     self.check_extract_features_raises_error_with_invalid_image_size(
         image_height, image_width, depth_multiplier, pad_to_multiple,
-        use_keras=use_keras)
+        use_keras=self._use_keras)
 
-  def test_preprocess_returns_correct_value_range(self, use_keras):
-    image_height = 128
-    image_width = 128
+  def test_preprocess_returns_correct_value_range(self):
     depth_multiplier = 1
     pad_to_multiple = 1
-    test_image = np.random.rand(4, image_height, image_width, 3)
-    feature_extractor = self._create_feature_extractor(depth_multiplier,
-                                                       pad_to_multiple,
-                                                       use_keras=use_keras)
+    # preprocess is applied per element, so a small image exercises it fully.
+    test_image = np.random.rand(1, 8, 8, 3).astype(np.float32)
+    feature_extractor = self._create_feature_extractor(
+        depth_multiplier, pad_to_multiple, use_keras=self._use_keras)
+    # preprocess is elementwise arithmetic, so on a numpy input it evaluates
+    # in numpy without building a graph or running a session.
     preprocessed_image = feature_extractor.preprocess(test_image)
+    self.assertAllClose(preprocessed_image,
+                        (2.0 / 255.0) * test_image - 1.0)
     self.assertTrue(np.all(np.less_equal(np.abs(preprocessed_image), 1.0)))
 
-  def test_variables_only_created_in_scope(self, use_keras):
+  def test_variables_only_created_in_scope(self):
     depth_multiplier = 1
     pad_to_multiple = 1
     scope_name = 'MobilenetV2'
     self.check_feature_extractor_variables_under_scope(
-        depth_multiplier, pad_to_multiple, scope_name, use_keras=use_keras)
+        depth_multiplier, pad_to_multiple, scope_name,
+        use_keras=self._use_keras)
 
-  def test_variable_count(self, use_keras):
+  def test_variable_count(self):
     depth_multiplier = 1
     pad_to_multiple = 1
     variables = self.get_feature_extractor_variables(
-        depth_multiplier, pad_to_multiple, use_keras=use_keras)
+        depth_multiplier, pad_to_multiple, use_keras=self._use_keras)
     self.assertEqual(len(variables), 292)
 
-  def test_has_fused_batchnorm(self, use_keras):
+  def test_has_fused_batchnorm(self):
     image_height = 40
     image_width = 40
     depth_multiplier = 1
     pad_to_multiple = 1
     image_placeholder = tf.placeholder(tf.float32,
                                        [1, image_height, image_width, 3])
-    feature_extractor = self._create_feature_extractor(depth_multiplier,
-                                                       pad_to_multiple,
-                                                       use_keras=use_keras)
+    feature_extractor = self._create_feature_extractor(
+        depth_multiplier, pad_to_multiple, use_keras=self._use_keras)
     preprocessed_image = feature_extractor.preprocess(image_placeholder)
-    if use_keras:
+    if self._use_keras:
       _ = feature_extractor(preprocessed_image)
     else:
       _ = feature_extractor.extract_features(preprocessed_image)
@@ -203,5 +216,17 @@ class SsdMobilenetV2FeatureExtractorTest(
                         for op in tf.get_default_graph().get_operations()))
 
 
+class SsdMobilenetV2FeatureExtractorSlimTest(
+    SsdMobilenetV2FeatureExtractorTestBase,
+    ssd_feature_extractor_test.SsdFeatureExtractorTestBase):
+  _use_keras = False
+
+
+class SsdMobilenetV2FeatureExtractorKerasTest(
+    SsdMobilenetV2FeatureExtractorTestBase,
+    ssd_feature_extractor_test.SsdFeatureExtractorTestBase):
+  _use_keras = True
+
+
 if __name__ == '__main__':
   tf.test.main()
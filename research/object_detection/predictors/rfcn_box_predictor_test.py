@@ -26,20 +26,27 @@ from utils import test_case
 
 class RfcnBoxPredictorTest(test_case.TestCase):
 
+  # Parsed once and shared across test methods; the proto is never mutated
+  # after parsing.
+  _conv_hyperparams = None
+
   def _build_arg_scope_with_conv_hyperparams(self):
-    conv_hyperparams = hyperparams_pb2.Hyperparams()
-    conv_hyperparams_text_proto = """
-      regularizer {
-        l2_regularizer {
+    if RfcnBoxPredictorTest._conv_hyperparams is None:
+      conv_hyperparams = hyperparams_pb2.Hyperparams()
+      conv_hyperparams_text_proto = """
+        regularizer {
+          l2_regularizer {
+          }
         }
-      }
-      initializer {
-        truncated_normal_initializer {
+        initializer {
+          truncated_normal_initializer {
+          }
         }
-      }
-    """
-    text_format.Merge(conv_hyperparams_text_proto, conv_hyperparams)
-    return hyperparams_builder.build(conv_hyperparams, is_training=True)
+      """
+      text_format.Merge(conv_hyperparams_text_proto, conv_hyperparams)
+      RfcnBoxPredictorTest._conv_hyperparams = conv_hyperparams
+    return hyperparams_builder.build(
+        RfcnBoxPredictorTest._conv_hyperparams, is_training=True)
 
   def test_get_correct_box_encoding_and_class_prediction_shapes(self):
 
@@ -64,8 +71,10 @@ class RfcnBoxPredictorTest(test_case.TestCase):
           axis=1)
       return (box_encodings, class_predictions_with_background)
 
-    image_features = np.random.rand(4, 8, 8, 64).astype(np.float32)
-    proposal_boxes = np.random.rand(4, 2, 4).astype(np.float32)
+    # Only output shapes are checked, so there is no need to pay for random
+    # input generation.
+    image_features = np.zeros((4, 8, 8, 64), dtype=np.float32)
+    proposal_boxes = np.zeros((4, 2, 4), dtype=np.float32)
     (box_encodings, class_predictions_with_background) = self.execute(
         graph_fn, [image_features, proposal_boxes])
 
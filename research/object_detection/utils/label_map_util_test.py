@@ -15,26 +15,20 @@
 """Tests for object_detection.utils.label_map_util."""
 
 import os
+import shutil
+import tempfile
+
 import tensorflow as tf
 
 from google.protobuf import text_format
 from protos import string_int_label_map_pb2
 from utils import label_map_util
 
-
-class LabelMapUtilTest(tf.test.TestCase):
-
-  def _generate_label_map(self, num_classes):
-    label_map_proto = string_int_label_map_pb2.StringIntLabelMap()
-    for i in range(1, num_classes + 1):
-      item = label_map_proto.item.add()
-      item.id = i
-      item.name = 'label_' + str(i)
-      item.display_name = str(i)
-    return label_map_proto
-
-  def test_get_label_map_dict(self):
-    label_map_string = """
+# pbtxt fixtures shared by the tests that load label maps from disk. The
+# files are deterministic, so they are written once per class rather than
+# once per test method.
+_LABEL_MAP_FIXTURES = [
+    ('cat_dog', """
       item {
         id:2
         name:'cat'
@@ -43,17 +37,18 @@ class LabelMapUtilTest(tf.test.TestCase):
         id:1
         name:'dog'
       }
-    """
-    label_map_path = os.path.join(self.get_temp_dir(), 'label_map.pbtxt')
-    with tf.gfile.Open(label_map_path, 'wb') as f:
-      f.write(label_map_string)
-
-    label_map_dict = label_map_util.get_label_map_dict(label_map_path)
-    self.assertEqual(label_map_dict['dog'], 1)
-    self.assertEqual(label_map_dict['cat'], 2)
-
-  def test_get_label_map_dict_display(self):
-    label_map_string = """
+    """),
+    ('dog_cat', """
+      item {
+        id:1
+        name:'dog'
+      }
+      item {
+        id:2
+        name:'cat'
+      }
+    """),
+    ('cat_dog_display', """
       item {
         id:2
         display_name:'cat'
@@ -62,18 +57,8 @@ class LabelMapUtilTest(tf.test.TestCase):
         id:1
         display_name:'dog'
       }
-    """
-    label_map_path = os.path.join(self.get_temp_dir(), 'label_map.pbtxt')
-    with tf.gfile.Open(label_map_path, 'wb') as f:
-      f.write(label_map_string)
-
-    label_map_dict = label_map_util.get_label_map_dict(
-        label_map_path, use_display_name=True)
-    self.assertEqual(label_map_dict['dog'], 1)
-    self.assertEqual(label_map_dict['cat'], 2)
-
-  def test_load_bad_label_map(self):
-    label_map_string = """
+    """),
+    ('bad_zero_indexed', """
       item {
         id:0
         name:'class that should not be indexed at zero'
@@ -86,16 +71,8 @@ class LabelMapUtilTest(tf.test.TestCase):
         id:1
         name:'dog'
       }
-    """
-    label_map_path = os.path.join(self.get_temp_dir(), 'label_map.pbtxt')
-    with tf.gfile.Open(label_map_path, 'wb') as f:
-      f.write(label_map_string)
-
-    with self.assertRaises(ValueError):
-      label_map_util.load_labelmap(label_map_path)
-
-  def test_load_label_map_with_background(self):
-    label_map_string = """
+    """),
+    ('background', """
       item {
         id:0
         name:'background'
@@ -108,18 +85,8 @@ class LabelMapUtilTest(tf.test.TestCase):
         id:1
         name:'dog'
       }
-    """
-    label_map_path = os.path.join(self.get_temp_dir(), 'label_map.pbtxt')
-    with tf.gfile.Open(label_map_path, 'wb') as f:
-      f.write(label_map_string)
-
-    label_map_dict = label_map_util.get_label_map_dict(label_map_path)
-    self.assertEqual(label_map_dict['background'], 0)
-    self.assertEqual(label_map_dict['dog'], 1)
-    self.assertEqual(label_map_dict['cat'], 2)
-
-  def test_get_label_map_dict_with_fill_in_gaps_and_background(self):
-    label_map_string = """
+    """),
+    ('gaps', """
       item {
         id:3
         name:'cat'
@@ -128,19 +95,83 @@ class LabelMapUtilTest(tf.test.TestCase):
         id:1
         name:'dog'
       }
-    """
-    label_map_path = os.path.join(self.get_temp_dir(), 'label_map.pbtxt')
-    with tf.gfile.Open(label_map_path, 'wb') as f:
-      f.write(label_map_string)
+    """),
+    ('name_and_display_name', """
+      item {
+        id:2
+        name:'cat'
+        display_name:'meow'
+      }
+      item {
+        id:1
+        name:'dog'
+        display_name:'woof'
+      }
+    """),
+]
+
+
+class LabelMapUtilTest(tf.test.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    super(LabelMapUtilTest, cls).setUpClass()
+    cls._label_map_dir = tempfile.mkdtemp()
+    cls._label_map_paths = {}
+    for name, label_map_string in _LABEL_MAP_FIXTURES:
+      label_map_path = os.path.join(cls._label_map_dir, name + '.pbtxt')
+      with open(label_map_path, 'w') as f:
+        f.write(label_map_string)
+      cls._label_map_paths[name] = label_map_path
 
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls._label_map_dir)
+    super(LabelMapUtilTest, cls).tearDownClass()
+
+  # Maps num_classes to a canonical generated proto; tests get a copy so
+  # mutations cannot leak between test methods.
+  _generated_label_maps = {}
+
+  def _generate_label_map(self, num_classes):
+    if num_classes not in self._generated_label_maps:
+      label_map_proto = string_int_label_map_pb2.StringIntLabelMap()
+      for i in range(1, num_classes + 1):
+        item = label_map_proto.item.add()
+        item.id = i
+        item.name = 'label_' + str(i)
+        item.display_name = str(i)
+      self._generated_label_maps[num_classes] = label_map_proto
+    label_map_proto = string_int_label_map_pb2.StringIntLabelMap()
+    label_map_proto.CopyFrom(self._generated_label_maps[num_classes])
+    return label_map_proto
+
+  def test_get_label_map_dict(self):
     label_map_dict = label_map_util.get_label_map_dict(
-        label_map_path, fill_in_gaps_and_background=True)
+        self._label_map_paths['cat_dog'])
+    self.assertDictEqual(label_map_dict, {'dog': 1, 'cat': 2})
 
-    self.assertEqual(label_map_dict['background'], 0)
-    self.assertEqual(label_map_dict['dog'], 1)
-    self.assertEqual(label_map_dict['class_2'], 2)
-    self.assertEqual(label_map_dict['cat'], 3)
-    self.assertEqual(len(label_map_dict), max(label_map_dict.values()) + 1)
+  def test_get_label_map_dict_display(self):
+    label_map_dict = label_map_util.get_label_map_dict(
+        self._label_map_paths['cat_dog_display'], use_display_name=True)
+    self.assertDictEqual(label_map_dict, {'dog': 1, 'cat': 2})
+
+  def test_load_bad_label_map(self):
+    with self.assertRaises(ValueError):
+      label_map_util.load_labelmap(self._label_map_paths['bad_zero_indexed'])
+
+  def test_load_label_map_with_background(self):
+    label_map_dict = label_map_util.get_label_map_dict(
+        self._label_map_paths['background'])
+    self.assertDictEqual(label_map_dict,
+                         {'background': 0, 'dog': 1, 'cat': 2})
+
+  def test_get_label_map_dict_with_fill_in_gaps_and_background(self):
+    label_map_dict = label_map_util.get_label_map_dict(
+        self._label_map_paths['gaps'], fill_in_gaps_and_background=True)
+
+    self.assertDictEqual(
+        label_map_dict, {'background': 0, 'dog': 1, 'class_2': 2, 'cat': 3})
 
   def test_keep_categories_with_unique_id(self):
     label_map_proto = string_int_label_map_pb2.StringIntLabelMap()
@@ -165,7 +196,7 @@ class LabelMapUtilTest(tf.test.TestCase):
     text_format.Merge(label_map_string, label_map_proto)
     categories = label_map_util.convert_label_map_to_categories(
         label_map_proto, max_num_classes=3)
-    self.assertListEqual([{
+    self.assertEqual([{
         'id': 2,
         'name': u'cat'
     }, {
@@ -186,7 +217,7 @@ class LabelMapUtilTest(tf.test.TestCase):
         'name': u'category_3',
         'id': 3
     }]
-    self.assertListEqual(expected_categories_list, categories)
+    self.assertEqual(expected_categories_list, categories)
 
   def test_convert_label_map_to_categories(self):
     label_map_proto = self._generate_label_map(num_classes=4)
@@ -202,7 +233,7 @@ class LabelMapUtilTest(tf.test.TestCase):
         'name': u'3',
         'id': 3
     }]
-    self.assertListEqual(expected_categories_list, categories)
+    self.assertEqual(expected_categories_list, categories)
 
   def test_convert_label_map_to_categories_with_few_classes(self):
     label_map_proto = self._generate_label_map(num_classes=4)
@@ -215,7 +246,7 @@ class LabelMapUtilTest(tf.test.TestCase):
         'name': u'2',
         'id': 2
     }]
-    self.assertListEqual(expected_categories_list, cat_no_offset)
+    self.assertEqual(expected_categories_list, cat_no_offset)
 
   def test_get_max_label_map_index(self):
     num_classes = 4
@@ -238,22 +269,9 @@ class LabelMapUtilTest(tf.test.TestCase):
     }, category_index)
 
   def test_create_categories_from_labelmap(self):
-    label_map_string = """
-      item {
-        id:1
-        name:'dog'
-      }
-      item {
-        id:2
-        name:'cat'
-      }
-    """
-    label_map_path = os.path.join(self.get_temp_dir(), 'label_map.pbtxt')
-    with tf.gfile.Open(label_map_path, 'wb') as f:
-      f.write(label_map_string)
-
-    categories = label_map_util.create_categories_from_labelmap(label_map_path)
-    self.assertListEqual([{
+    categories = label_map_util.create_categories_from_labelmap(
+        self._label_map_paths['dog_cat'])
+    self.assertEqual([{
         'name': u'dog',
         'id': 1
     }, {
@@ -262,22 +280,8 @@ class LabelMapUtilTest(tf.test.TestCase):
     }], categories)
 
   def test_create_category_index_from_labelmap(self):
-    label_map_string = """
-      item {
-        id:2
-        name:'cat'
-      }
-      item {
-        id:1
-        name:'dog'
-      }
-    """
-    label_map_path = os.path.join(self.get_temp_dir(), 'label_map.pbtxt')
-    with tf.gfile.Open(label_map_path, 'wb') as f:
-      f.write(label_map_string)
-
     category_index = label_map_util.create_category_index_from_labelmap(
-        label_map_path)
+        self._label_map_paths['cat_dog'])
     self.assertDictEqual({
         1: {
             'name': u'dog',
@@ -290,22 +294,7 @@ class LabelMapUtilTest(tf.test.TestCase):
     }, category_index)
 
   def test_create_category_index_from_labelmap_display(self):
-    label_map_string = """
-      item {
-        id:2
-        name:'cat'
-        display_name:'meow'
-      }
-      item {
-        id:1
-        name:'dog'
-        display_name:'woof'
-      }
-    """
-    label_map_path = os.path.join(self.get_temp_dir(), 'label_map.pbtxt')
-    with tf.gfile.Open(label_map_path, 'wb') as f:
-      f.write(label_map_string)
-
+    label_map_path = self._label_map_paths['name_and_display_name']
     self.assertDictEqual({
         1: {
             'name': u'dog',